@@ -19,8 +19,13 @@
 
 import sys
 import json
+import argparse
+import subprocess
+from dataclasses import dataclass
+from collections.abc import Iterator
 from socket import gethostname
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
 from gi.repository import Gio, GLib
 
@@ -412,159 +417,571 @@ if "RB" in gethostname():
 
 GlibValue = None | str | bool | int | list[str] | GLib.Variant
 
+MEDIA_KEYS_SCHEMA = "org.gnome.settings-daemon.plugins.media-keys"
+BINDINGS_SCHEMA = f"{MEDIA_KEYS_SCHEMA}.custom-keybinding"
+TERMINAL_PROFILES_LIST_SCHEMA = "org.gnome.Terminal.ProfilesList"
+TERMINAL_PROFILE_SCHEMA = "org.gnome.Terminal.Legacy.Profile"
+
+
+def custom_keybinding_path(binding_id: str) -> str:
+    """Get the settings path of the custom keybinding `binding_id`."""
+    media_keys_path = "/" + MEDIA_KEYS_SCHEMA.replace(".", "/")
+    return f"{media_keys_path}/custom-keybindings/{binding_id}/"
+
+
+def terminal_profile_path(profile_id: str) -> str:
+    """Get the settings path of the terminal profile `profile_id`."""
+    return f"/org/gnome/terminal/legacy/profiles:/:{profile_id}/"
+
+
+@dataclass(frozen=True)
+class Change:
+    """A planned change of a single settings key.
+
+    `old` is the current user value of the key, or `None` if the key has no
+    user value.  `new` is the desired value, or `None` to reset the key.
+    """
+
+    settings: Gio.Settings
+    key: str
+    old: GLib.Variant | None
+    new: GLib.Variant | None
+
+    def to_json(self: "Change") -> str:
+        """Describe this change as a single line of JSON."""
+        return json.dumps({
+            "schema": self.settings.get_property("schema"),
+            "path": self.settings.get_property("path"),
+            "key": self.key,
+            "old": self.old.print_(True) if self.old is not None else None, # noqa: FBT003
+            "new": self.new.print_(True) if self.new is not None else None, # noqa: FBT003
+        })
+
+
+def to_variant(value_type: str, key: str,
+               value: GlibValue) -> GLib.Variant | None:
+    """Convert `value` of `key` to a variant of `value_type`.
+
+    Return `None` if `value` is `None`, i.e. if the key is to be reset.
+    """
+    if value is None or isinstance(value, GLib.Variant):
+        return value
+    if isinstance(value, str | bool | int | list):
+        return GLib.Variant(value_type, value)
+    message = f"Value {value!r} for key {key} has unknown type"
+    raise TypeError(message)
 
-def set_pytype(settings: Gio.Settings, key: str, value: GlibValue) -> None:
-    """Set `key` in `settings` to the given `value`."""
-    if value is None:
-        settings.reset(key)
-    elif isinstance(value, GLib.Variant):
-        settings.set_value(key, value)
-    elif isinstance(value, str):
-        settings.set_string(key, value)
-    elif isinstance(value, bool):
-        settings.set_boolean(key, value)
-    elif isinstance(value, int):
-        settings.set_int(key, value)
-    elif isinstance(value, list):
-        settings.set_strv(key, value)
-    else:
-        message = f"Value {value!r} for key {key} has unknown type"
-        raise TypeError(message)
 
+def plan_items(registry: "SchemaRegistry", settings: Gio.Settings,
+               items: dict[str, GlibValue]) -> list[Change]:
+    """Plan changes to apply all `items` to `settings`.
 
-def set_all_items(settings: Gio.Settings, items: dict[str, GlibValue]) -> None:
-    """Apply all `items` to `settings`."""
-    settings_schema = settings.get_property("settings-schema")
+    Compare every item with the current user value in `settings`, and return
+    changes for those keys which actually differ.
+    """
     schema = settings.get_property("schema")
+    key_types = registry.key_types(schema) or {}
+    changes = []
     for key, value in items.items():
-        if settings_schema.has_key(key):
-            print(f"{schema}.{key} = {value}")
-            set_pytype(settings, key, value)
-        else:
+        if key not in key_types:
             print(f"{schema}.{key} does not exist!", file=sys.stderr)
-
-
-def apply_settings() -> None:
-    """Apply all standard settings."""
-    default_source = Gio.SettingsSchemaSource.get_default()
-    if not default_source:
-        msg = "No default schema source found!"
-        raise LookupError(msg)
+            continue
+        new = to_variant(key_types[key], key, value)
+        old = settings.get_user_value(key)
+        if new is None and old is None:
+            continue
+        if new is not None and old is not None and new.equal(old):
+            continue
+        changes.append(Change(settings=settings, key=key, old=old, new=new))
+    return changes
+
+
+def check_value(schema_id: str, schema_key: Gio.SettingsSchemaKey,
+                value: GLib.Variant) -> str | None:
+    """Check `value` against `schema_key` of the schema `schema_id`.
+
+    Return an error message if `value` has the wrong type or is out of range
+    for the key, or `None` if `value` is valid.
+    """
+    key = schema_key.get_name()
+    expected_type = schema_key.get_value_type().dup_string()
+    if value.get_type_string() != expected_type:
+        return (f"{schema_id}.{key}: expected type {expected_type}, "
+                f"got {value.get_type_string()}")
+    if not schema_key.range_check(value):
+        return f"{schema_id}.{key}: {value} out of range"
+    return None
+
+
+def validate_changes(changes: list[Change]) -> None:
+    """Validate all `changes` against their schemas.
+
+    Raise `ValueError` if any change has a value of the wrong type or outside
+    the range permitted by the schema.
+    """
+    errors = []
+    for change in changes:
+        if change.new is None:
+            continue
+        schema_key = change.settings.get_property("settings-schema") \
+            .get_key(change.key)
+        error = check_value(change.settings.get_property("schema"),
+                            schema_key, change.new)
+        if error:
+            errors.append(error)
+    if errors:
+        message = "Invalid settings:\n" + "\n".join(errors)
+        raise ValueError(message)
+
+
+def apply_changes(changes: list[Change]) -> None:
+    """Apply all `changes` in batches.
+
+    Apply all changes to the same settings object in delayed mode, so that
+    each settings object commits its changes to dconf at once.
+
+    `changes` should be validated with `validate_changes` first.
+    """
+    batches: dict[Gio.Settings, list[Change]] = {}
+    for change in changes:
+        batches.setdefault(change.settings, []).append(change)
+    for settings, batch in batches.items():
+        settings.delay()
+        for change in batch:
+            if change.new is None:
+                settings.reset(change.key)
+            else:
+                settings.set_value(change.key, change.new)
+        settings.apply()
+
+
+EXTENSION_PREFIXES = [
+    Path("/usr/share/gnome-shell/extensions"),
+    Path.home() / "local" / "share" / "gnome-shell" / "extensions",
+]
+
+
+def default_schema_files() -> list[Path]:
+    """Get all compiled schema files of the default schema source."""
+    directories = [Path(d) for d in
+                   (GLib.getenv("GSETTINGS_SCHEMA_DIR") or "").split(":")
+                   if d]
+    directories.append(Path(GLib.get_user_data_dir()) / "glib-2.0" / "schemas")
+    directories.extend(Path(d) / "glib-2.0" / "schemas"
+                       for d in GLib.get_system_data_dirs())
+    return [d / "gschemas.compiled" for d in directories]
+
+
+def mtime_ns(path: Path) -> int | None:
+    """Get the mtime of `path` in nanoseconds, or `None` if it doesn't exist."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SchemaRegistry:
+    """A registry of all settings schemas.
+
+    Resolve the default schema source and the schema sources of extensions
+    once, and index key names and value types of all schemas looked up.
+
+    Persist the schema directories of extensions and the index of key types in
+    a cache file, which remains valid as long as no compiled schema files and
+    no extension directories change.  With a valid cache, serve key types from
+    the cache, and skip probing extension directories and looking up schemas
+    known not to exist.  Schemas which exist still get loaded from their schema
+    source on every run, because applying settings needs the schema itself.
+    """
+
+    def __init__(self: "SchemaRegistry", cache_file: Path) -> None:
+        """Create a new registry, and load the index from `cache_file`."""
+        default_source = Gio.SettingsSchemaSource.get_default()
+        if not default_source:
+            msg = "No default schema source found!"
+            raise LookupError(msg)
+        self._default_source = default_source
+        self._cache_file = cache_file
+        self._sources: dict[str, Gio.SettingsSchemaSource] = {}
+        self._schemas: dict[str, Gio.SettingsSchema | None] = {}
+        self._extension_dirs: dict[str, str | None] = {}
+        self._key_types: dict[str, dict[str, str] | None] = {}
+        self._dirty = False
+        self._load_cache()
+
+    def _stamp(self: "SchemaRegistry") -> dict[str, int | None]:
+        """Get the mtimes of all files and directories the index depends on."""
+        paths = [*default_schema_files(), *EXTENSION_PREFIXES]
+        paths.extend(Path(d) / "gschemas.compiled"
+                     for d in self._extension_dirs.values() if d)
+        return {str(p): mtime_ns(p) for p in paths}
+
+    def _load_cache(self: "SchemaRegistry") -> None:
+        """Load extension directories and key types from the cache file."""
+        try:
+            cache = json.loads(self._cache_file.read_text())
+            stamp = cache["stamp"]
+            extension_dirs = cache["extension_dirs"]
+            key_types = cache["key_types"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # Treat any unreadable or malformed cache as a cache miss
+            return
+        if not all(isinstance(c, dict)
+                   for c in (stamp, extension_dirs, key_types)):
+            return
+        self._extension_dirs = extension_dirs
+        if stamp == self._stamp():
+            self._key_types = key_types
+        else:
+            self._extension_dirs = {}
+
+    def save(self: "SchemaRegistry") -> None:
+        """Save the index to the cache file if it changed."""
+        if not self._dirty:
+            return
+        cache = {
+            "stamp": self._stamp(),
+            "extension_dirs": self._extension_dirs,
+            "key_types": self._key_types,
+        }
+        self._cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._cache_file.write_text(json.dumps(cache))
+        self._dirty = False
+
+    def extension_dir(self: "SchemaRegistry", uuid: str) -> Path | None:
+        """Get the schema directory of the extension `uuid`, if any."""
+        if uuid not in self._extension_dirs:
+            schema_dirs = (p / uuid / "schemas" for p in EXTENSION_PREFIXES)
+            schema_dir = next((d for d in schema_dirs if d.exists()), None)
+            self._extension_dirs[uuid] = str(schema_dir) if schema_dir else None
+            self._dirty = True
+        schema_dir = self._extension_dirs[uuid]
+        return Path(schema_dir) if schema_dir else None
+
+    def source(self: "SchemaRegistry",
+               uuid: str | None = None) -> Gio.SettingsSchemaSource:
+        """Get the schema source of the extension `uuid`.
+
+        If `uuid` is `None` get the default schema source.
+        """
+        if uuid is None:
+            return self._default_source
+        if uuid not in self._sources:
+            schema_dir = self.extension_dir(uuid)
+            if schema_dir:
+                self._sources[uuid] = Gio.SettingsSchemaSource.new_from_directory(
+                    directory=str(schema_dir),
+                    parent=self._default_source,
+                    trusted=True,
+                )
+            else:
+                # System extensions ideally have their schema in the default
+                # glib schema directory, to integrate better with gsettings
+                # and dconf editor.
+                self._sources[uuid] = self._default_source
+        return self._sources[uuid]
+
+    def lookup(self: "SchemaRegistry", schema_id: str,
+               uuid: str | None = None) -> Gio.SettingsSchema | None:
+        """Look up the schema `schema_id`, optionally of the extension `uuid`."""
+        if schema_id not in self._schemas:
+            if schema_id in self._key_types and self._key_types[schema_id] is None:
+                # The cache knows that this schema doesn't exist, so don't even
+                # bother to create a schema source for it.
+                self._schemas[schema_id] = None
+                return None
+            schema = self.source(uuid).lookup(schema_id, True) # noqa: FBT003
+            self._schemas[schema_id] = schema
+            if schema is None:
+                self._key_types[schema_id] = None
+                self._dirty = True
+            elif self._key_types.get(schema_id) is None:
+                self._key_types[schema_id] = {
+                    key: schema.get_key(key).get_value_type().dup_string()
+                    for key in schema.list_keys()}
+                self._dirty = True
+        return self._schemas[schema_id]
+
+    def key_types(self: "SchemaRegistry", schema_id: str,
+                  uuid: str | None = None) -> dict[str, str] | None:
+        """Get the value types of all keys in the schema `schema_id`.
+
+        Return `None` if the schema does not exist.
+        """
+        if schema_id not in self._key_types:
+            self.lookup(schema_id, uuid)
+        return self._key_types[schema_id]
+
+
+def plan_settings(registry: SchemaRegistry) -> list[Change]:
+    """Plan all standard settings."""
+    changes = []
     for schema_id_or_path, items in SETTINGS.items():
         if isinstance(schema_id_or_path, str):
             schema_id = schema_id_or_path
             path = None
         else:
             schema_id, path = schema_id_or_path
-        schema = default_source.lookup(schema_id, False) # noqa: FBT003
+        schema = registry.lookup(schema_id)
         if schema:
             settings = Gio.Settings.new_full(schema=schema, backend=None,
                                              path=path)
-            set_all_items(settings, items)
+            changes.extend(plan_items(registry, settings, items))
         else:
             print(f"Skipping non-existing schema {schema_id}", file=sys.stderr)
+    return changes
 
 
-def apply_extension_settings() -> None:
-    """Apply all settings for gnome extensions."""
-    default_source = Gio.SettingsSchemaSource.get_default()
-    if not default_source:
-        msg = "No default schema source found!"
-        raise LookupError(msg)
-    extension_prefixes = [
-        Path("/usr/share/gnome-shell/extensions"),
-        Path.home() / "local" / "share" / "gnome-shell" / "extensions",
-    ]
+def plan_extension_settings(registry: SchemaRegistry) -> list[Change]:
+    """Plan all settings for gnome extensions."""
+    changes = []
     for uuid, schemas in EXTENSION_SETTINGS.items():
-        schema_dirs = (p / uuid / "schemas" for p in extension_prefixes)
-        schema_dir = next((d for d in schema_dirs if d.exists()), None)
-        if schema_dir:
-            source = Gio.SettingsSchemaSource.new_from_directory(
-                directory=str(schema_dir),
-                parent=default_source,
-                trusted=True,
-            )
-        else:
-            # System extensions ideally have their schema in the default
-            # glib schema directory, to integrate better with gsettings and
-            # dconf editor.
-            source = default_source
         for schema_id, items in schemas.items():
-            schema = source.lookup(schema_id, False) # noqa: FBT003
+            schema = registry.lookup(schema_id, uuid)
             if schema:
                 settings = Gio.Settings.new_full(schema=schema, backend=None,
                                                  path=None)
-                set_all_items(settings, items)
+                changes.extend(plan_items(registry, settings, items))
             else:
                 print(f"Schema {schema_id} does not exist; extension {uuid} "
                       "not installed?", file=sys.stderr)
+    return changes
 
 
-def apply_keybindings() -> None:
-    """Apply all keybindings."""
-    default_source = Gio.SettingsSchemaSource.get_default()
-    if not default_source:
-        msg = "No default schema source found!"
-        raise LookupError(msg)
-    media_keys_schema = "org.gnome.settings-daemon.plugins.media-keys"
-    media_keys_path = "/" + media_keys_schema.replace(".", "/")
-    bindings_schema = f"{media_keys_schema}.custom-keybinding"
-    if not default_source.lookup(bindings_schema, False): # noqa: FBT003
+def plan_keybindings(registry: SchemaRegistry) -> list[Change]:
+    """Plan all keybindings."""
+    bindings_schema = registry.lookup(BINDINGS_SCHEMA)
+    media_keys_schema = registry.lookup(MEDIA_KEYS_SCHEMA)
+    if not bindings_schema or not media_keys_schema:
         print("Schema for custom keybindings not found, skipping", file=sys.stderr)
-    else:
-        new_bindings = []
-        removed_bindings = []
-        for binding_id, binding in BINDINGS.items():
-            path = f"{media_keys_path}/custom-keybindings/{binding_id}/"
-            settings = Gio.Settings.new_with_path(
-                schema_id=bindings_schema, path=path)
-            if not binding:
-                schema = settings.get_property("settings-schema")
-                for key in schema.list_keys():
-                    settings.reset(key)
-                print(f"binding {binding_id} removed")
-                removed_bindings.append(path)
-            else:
-                settings.set_string("name", binding["name"])
-                settings.set_string("command", binding["command"])
-                settings.set_string("binding", binding["binding"])
-                print("{id} {binding}: {name} ({command})".format(
-                    id=binding_id, **binding))
-                new_bindings.append(path)
-
-        media_keys = Gio.Settings(schema=media_keys_schema)
-        custom_bindings = media_keys.get_strv("custom-keybindings")
-        custom_bindings.extend(p for p in new_bindings if p not in custom_bindings)
-        for path in removed_bindings:
-            if path in custom_bindings:
-                custom_bindings.remove(path)
-        media_keys.set_strv("custom-keybindings", custom_bindings)
-
-
-def apply_gnome_terminal() -> None:
-    """Apply gnome-terminal settings."""
-    default_source = Gio.SettingsSchemaSource.get_default()
-    if not default_source:
-        msg = "No default schema source found!"
-        raise LookupError(msg)
-    schema_id = "org.gnome.Terminal.ProfilesList"
-    if not default_source.lookup(schema_id, False): # noqa: FBT003
+        return []
+
+    changes = []
+    new_bindings = []
+    removed_bindings = []
+    for binding_id, binding in BINDINGS.items():
+        path = custom_keybinding_path(binding_id)
+        settings = Gio.Settings.new_full(
+            schema=bindings_schema, backend=None, path=path)
+        if not binding:
+            items: dict[str, GlibValue] = dict.fromkeys(
+                registry.key_types(BINDINGS_SCHEMA) or {})
+            removed_bindings.append(path)
+        else:
+            items = {key: binding[key] for key in ["name", "command", "binding"]}
+            new_bindings.append(path)
+        changes.extend(plan_items(registry, settings, items))
+
+    media_keys = Gio.Settings.new_full(
+        schema=media_keys_schema, backend=None, path=None)
+    custom_bindings = media_keys.get_strv("custom-keybindings")
+    custom_bindings.extend(p for p in new_bindings if p not in custom_bindings)
+    for path in removed_bindings:
+        if path in custom_bindings:
+            custom_bindings.remove(path)
+    changes.extend(plan_items(registry, media_keys,
+                              {"custom-keybindings": custom_bindings}))
+    return changes
+
+
+def plan_gnome_terminal(registry: SchemaRegistry) -> list[Change]:
+    """Plan gnome-terminal settings."""
+    profiles_list_schema = registry.lookup(TERMINAL_PROFILES_LIST_SCHEMA)
+    profile_schema = registry.lookup(TERMINAL_PROFILE_SCHEMA)
+    if not profiles_list_schema or not profile_schema:
         print("Terminal profile list not available, skipping", file=sys.stderr)
+        return []
+
+    profiles_list = Gio.Settings.new_full(
+        schema=profiles_list_schema, backend=None, path=None)
+    profile_id = profiles_list.get_string("default")
+    settings = Gio.Settings.new_full(
+        schema=profile_schema, backend=None,
+        path=terminal_profile_path(profile_id))
+    return plan_items(registry, settings, TERMINAL_PROFILE)
+
+
+Keyfile = dict[str, dict[str, GLib.Variant]]
+
+
+def compile_items(keyfile: Keyfile, schema: Gio.SettingsSchema,
+                  path: str | None, items: dict[str, GlibValue]) -> list[str]:
+    """Compile all `items` of `schema` at `path` into `keyfile`.
+
+    Check all items against `schema`, and return error messages for items
+    which do not match the schema.  Skip items which reset a key, because a
+    key absent from the keyfile has its default value anyway.
+    """
+    schema_id = schema.get_id()
+    path = path or schema.get_path()
+    if not path:
+        return [f"{schema_id} is relocatable but no path given"]
+    group = keyfile.setdefault(path.strip("/"), {})
+    errors = []
+    for key, value in items.items():
+        if not schema.has_key(key):
+            print(f"{schema_id}.{key} does not exist!", file=sys.stderr)
+            continue
+        schema_key = schema.get_key(key)
+        variant = to_variant(schema_key.get_value_type().dup_string(),
+                             key, value)
+        if variant is None:
+            continue
+        error = check_value(schema_id, schema_key, variant)
+        if error:
+            errors.append(error)
+        else:
+            group[key] = variant
+    return errors
+
+
+CompileTarget = tuple[str | None, str, str | None, dict[str, GlibValue]]
+
+
+def compile_targets(registry: SchemaRegistry) -> Iterator[CompileTarget]:
+    """Get all schemas, paths and items to compile into a keyfile.
+
+    Yield the extension UUID, the schema ID, the path and the items for every
+    schema.  The UUID is `None` for schemas which do not belong to an
+    extension.
+    """
+    for schema_id_or_path, items in SETTINGS.items():
+        if isinstance(schema_id_or_path, str):
+            yield (None, schema_id_or_path, None, items)
+        else:
+            schema_id, path = schema_id_or_path
+            yield (None, schema_id, path, items)
+
+    for uuid, schemas in EXTENSION_SETTINGS.items():
+        for schema_id, items in schemas.items():
+            yield (uuid, schema_id, None, items)
+
+    custom_bindings = []
+    for binding_id, binding in BINDINGS.items():
+        if binding:
+            path = custom_keybinding_path(binding_id)
+            items = {key: binding[key] for key in ["name", "command", "binding"]}
+            yield (None, BINDINGS_SCHEMA, path, items)
+            custom_bindings.append(path)
+    yield (None, MEDIA_KEYS_SCHEMA, None,
+           {"custom-keybindings": custom_bindings})
+
+    # Without a session we can't read the current default profile, so we
+    # configure the profile which gnome-terminal uses by default.
+    profiles_list = registry.lookup(TERMINAL_PROFILES_LIST_SCHEMA)
+    if profiles_list:
+        profile_id = profiles_list.get_key("default") \
+            .get_default_value().get_string()
+        yield (None, TERMINAL_PROFILE_SCHEMA,
+               terminal_profile_path(profile_id), TERMINAL_PROFILE)
     else:
-        profiles_list = Gio.Settings(schema=schema_id)
-        profile_id = profiles_list.get_string("default")
-        schema_id = "org.gnome.Terminal.Legacy.Profile"
-        path = f"/org/gnome/terminal/legacy/profiles:/:{profile_id}/"
-        settings = Gio.Settings.new_with_path(schema_id=schema_id, path=path)
-        set_all_items(settings, TERMINAL_PROFILE)
+        print("Terminal profile list not available, skipping", file=sys.stderr)
+
+
+def format_keyfile(keyfile: Keyfile) -> str:
+    """Format `keyfile` in the dconf keyfile format."""
+    sections = []
+    for group, values in keyfile.items():
+        lines = [f"[{group}]"]
+        lines.extend(f"{key}={value.print_(True)}" # noqa: FBT003
+                     for key, value in values.items())
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections) + "\n"
+
+
+def compile_keyfile(registry: SchemaRegistry) -> str:
+    """Compile all settings into a dconf keyfile.
+
+    Look up all schemas from the compiled schemas on disk, and check all
+    settings against these schemas, but do not read or write any current
+    settings.  This neither needs a session bus nor a graphical session.
+
+    Return the contents of the keyfile.
+    """
+    keyfile: Keyfile = {}
+    errors = []
+    for uuid, schema_id, path, items in compile_targets(registry):
+        schema = registry.lookup(schema_id, uuid)
+        if schema:
+            errors.extend(compile_items(keyfile, schema, path, items))
+        else:
+            print(f"Skipping non-existing schema {schema_id}", file=sys.stderr)
+    if errors:
+        message = "Invalid settings:\n" + "\n".join(errors)
+        raise ValueError(message)
+    return format_keyfile(keyfile)
+
+
+def compile_database(target: Path, keyfile: str) -> None:
+    """Compile `keyfile` into a binary dconf database at `target`."""
+    with TemporaryDirectory() as directory:
+        (Path(directory) / "00-swsnr-dotfiles").write_text(keyfile)
+        print(f"Compiling dconf database {target}", file=sys.stderr)
+        subprocess.run(["/usr/bin/dconf", "compile", str(target), directory],
+                       check=True)
 
 
 def main() -> None:
-    """Run this program."""
-    apply_settings()
-    apply_extension_settings()
-    apply_keybindings()
-    apply_gnome_terminal()
+    """Run this program.
+
+    Read all current settings first, and then only write those settings which
+    differ from the desired value.  Print every planned change as a line of
+    JSON to standard output.
+
+    Validate all changes before applying any, and abort without changing
+    anything if any change is invalid.
+
+    With --keyfile or --database compile all settings into a dconf keyfile or
+    database instead, e.g. to provision images or new user profiles.
+    """
+    parser = argparse.ArgumentParser(description="Apply my Gnome settings")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only print planned changes, do not apply them")
+    offline = parser.add_mutually_exclusive_group()
+    offline.add_argument("--keyfile", type=Path,
+                         help="Write all settings to the given dconf keyfile "
+                         "instead of applying them to the current session")
+    offline.add_argument("--database", type=Path,
+                         help="Compile all settings to the given dconf "
+                         "database instead of applying them to the current "
+                         "session")
+    args = parser.parse_args()
+
+    cache_file = Path(GLib.get_user_cache_dir()) / "swsnr-dotfiles" \
+        / "gnome-settings-schemas.json"
+    registry = SchemaRegistry(cache_file)
+    try:
+        apply_or_compile(args, registry)
+    finally:
+        registry.save()
+
+
+def apply_or_compile(args: argparse.Namespace, registry: SchemaRegistry) -> None:
+    """Apply or compile all settings according to `args`."""
+    if args.keyfile or args.database:
+        keyfile = compile_keyfile(registry)
+        if args.keyfile:
+            print(f"Writing {args.keyfile}", file=sys.stderr)
+            args.keyfile.parent.mkdir(parents=True, exist_ok=True)
+            args.keyfile.write_text(keyfile)
+        else:
+            args.database.parent.mkdir(parents=True, exist_ok=True)
+            compile_database(args.database, keyfile)
+        return
+
+    changes = [
+        *plan_settings(registry),
+        *plan_extension_settings(registry),
+        *plan_keybindings(registry),
+        *plan_gnome_terminal(registry),
+    ]
+    validate_changes(changes)
+    for change in changes:
+        print(change.to_json())
+    if not args.dry_run:
+        apply_changes(changes)
+        # Make sure all writes reached dconf before we exit
+        Gio.Settings.sync()
 
 
 if __name__ == "__main__":
@@ -17,8 +17,10 @@
 
 
 import json
+import os
 from subprocess import run
 from pathlib import Path
+from typing import NamedTuple
 
 
 SETTINGS = {
@@ -105,26 +107,283 @@ EXTENSIONS = [
 ]
 
 
+def installed_extensions() -> set[str]:
+    """Get the IDs of all installed vscode extensions, in lowercase.
+
+    Extension IDs are case-insensitive.
+    """
+    output = run(
+        ["/usr/bin/code", "--list-extensions", "--show-versions"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    # Each line has the form publisher.name@version
+    return {line.partition("@")[0].lower()
+            for line in output.splitlines() if line.strip()}
+
+
 def install_extensions() -> None:
-    """Install desired vscode extensions."""
-    for extension in EXTENSIONS:
-        run(["/usr/bin/code", "--install-extension", extension], check=True)
+    """Install desired vscode extensions which are not yet installed.
+
+    Install all missing extensions with a single invocation of code, to start
+    code only once.
+    """
+    installed = installed_extensions()
+    missing = [extension for extension in EXTENSIONS
+               if extension.lower() not in installed]
+    if not missing:
+        return
+    args = ["/usr/bin/code"]
+    for extension in missing:
+        args.extend(["--install-extension", extension])
+    run(args, check=True)
+
+
+def skip_whitespace_and_comments(text: str, pos: int) -> int:
+    """Skip whitespace and JSONC comments in `text` from `pos` on."""
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+        elif text.startswith("//", pos):
+            end = text.find("\n", pos)
+            pos = len(text) if end == -1 else end + 1
+        elif text.startswith("/*", pos):
+            end = text.find("*/", pos + 2)
+            if end == -1:
+                msg = f"Unterminated comment at {pos}"
+                raise ValueError(msg)
+            pos = end + 2
+        else:
+            break
+    return pos
+
+
+def skip_string(text: str, pos: int) -> int:
+    """Skip the JSON string starting at `pos` in `text`."""
+    end = pos + 1
+    while end < len(text):
+        if text[end] == "\\":
+            end += 2
+        elif text[end] == '"':
+            return end + 1
+        else:
+            end += 1
+    msg = f"Unterminated string at {pos}"
+    raise ValueError(msg)
+
+
+def skip_value(text: str, pos: int) -> int:
+    """Skip the JSONC value starting at `pos` in `text`.
+
+    Return the position right after the value.
+    """
+    if text.startswith('"', pos):
+        return skip_string(text, pos)
+    if text.startswith(("{", "["), pos):
+        depth = 0
+        while pos < len(text):
+            pos = skip_whitespace_and_comments(text, pos)
+            if text.startswith('"', pos):
+                pos = skip_string(text, pos)
+                continue
+            if text[pos] in "{[":
+                depth += 1
+            elif text[pos] in "}]":
+                depth -= 1
+                if depth == 0:
+                    return pos + 1
+            pos += 1
+        msg = "Unterminated object or array"
+        raise ValueError(msg)
+    # A literal or a number
+    end = pos
+    while end < len(text) and not (
+            text[end].isspace() or text[end] in ",:{}[]/"):
+        end += 1
+    if end == pos:
+        msg = f"Expected value at {pos}"
+        raise ValueError(msg)
+    return end
+
+
+def strip_jsonc(text: str) -> str:
+    """Strip comments and trailing commas from JSONC `text`."""
+    parts = []
+    pos = 0
+    while pos < len(text):
+        start = pos
+        pos = skip_whitespace_and_comments(text, pos)
+        if start < pos:
+            parts.append(" ")
+            continue
+        if text[pos] == '"':
+            pos = skip_string(text, pos)
+            parts.append(text[start:pos])
+            continue
+        if text[pos] == ",":
+            following = skip_whitespace_and_comments(text, pos + 1)
+            if text.startswith(("}", "]"), following):
+                pos += 1
+                continue
+        parts.append(text[pos])
+        pos += 1
+    return "".join(parts)
+
+
+def loads_jsonc(text: str) -> object:
+    """Parse JSONC `text`, i.e. JSON with comments and trailing commas."""
+    return json.loads(strip_jsonc(text))
+
+
+class JsoncObject(NamedTuple):
+    """The layout of the top-level object in a JSONC document."""
+
+    # The start and end of the value of each member, by key
+    members: dict[str, tuple[int, int]]
+    # The end of the value of the last member, if any
+    last_value_end: int | None
+    # Whether the last member has a trailing comma
+    trailing_comma: bool
+    # The position of the closing brace
+    closing_brace: int
+
+
+def scan_jsonc_object(text: str) -> JsoncObject:
+    """Scan the layout of the top-level JSONC object in `text`."""
+    pos = skip_whitespace_and_comments(text, 0)
+    if not text.startswith("{", pos):
+        msg = "Expected a JSON object"
+        raise ValueError(msg)
+    members = {}
+    last_value_end = None
+    trailing_comma = False
+    pos = skip_whitespace_and_comments(text, pos + 1)
+    while not text.startswith("}", pos):
+        if not text.startswith('"', pos):
+            msg = f"Expected key at {pos}"
+            raise ValueError(msg)
+        key_end = skip_string(text, pos)
+        key = json.loads(text[pos:key_end])
+        pos = skip_whitespace_and_comments(text, key_end)
+        if not text.startswith(":", pos):
+            msg = f"Expected colon at {pos}"
+            raise ValueError(msg)
+        value_start = skip_whitespace_and_comments(text, pos + 1)
+        last_value_end = skip_value(text, value_start)
+        # With duplicate keys the last one wins
+        members[key] = (value_start, last_value_end)
+        pos = skip_whitespace_and_comments(text, last_value_end)
+        trailing_comma = text.startswith(",", pos)
+        if trailing_comma:
+            pos = skip_whitespace_and_comments(text, pos + 1)
+        elif not text.startswith("}", pos):
+            msg = f"Expected comma at {pos}"
+            raise ValueError(msg)
+    return JsoncObject(members, last_value_end, trailing_comma, pos)
+
+
+def member_indent(text: str, layout: JsoncObject) -> str:
+    """Get the indentation of members of the top-level object in `text`."""
+    if layout.members:
+        first_value = min(start for start, _ in layout.members.values())
+        line_start = text.rfind("\n", 0, first_value) + 1
+        line = text[line_start:first_value]
+        indent = line[:len(line) - len(line.lstrip())]
+        if indent:
+            return indent
+    return " " * 4
+
+
+def insert_members(
+        text: str, layout: JsoncObject,
+        members: list[str]) -> list[tuple[int, int, str]]:
+    """Get edits to insert formatted `members` at the end of the object.
+
+    Return a list of `(start, end, replacement)` edits, in the order in which
+    to apply them.
+    """
+    # Insert new members right after the last non-whitespace before the
+    # closing brace, to keep the closing line of the object as it is.
+    pos = layout.closing_brace
+    while text[pos - 1].isspace():
+        pos -= 1
+    inserted = ",".join(members)
+    if layout.trailing_comma:
+        inserted += ","
+    if pos == layout.closing_brace:
+        inserted += "\n"
+    edits = [(pos, pos, inserted)]
+    if layout.last_value_end is not None and not layout.trailing_comma:
+        # Apply last, in case the last value directly precedes `pos`.
+        edits.append((layout.last_value_end, layout.last_value_end, ","))
+    return edits
+
+
+def patch_jsonc(text: str, settings: dict[str, object]) -> str:
+    """Patch `settings` into the top-level JSONC object in `text`.
+
+    Only touch members whose value differs from `settings`, and add missing
+    members at the end of the object; leave everything else, in particular
+    comments and formatting, alone.
+    """
+    if not text.strip():
+        # Treat an empty file like an empty object
+        text = "{}\n"
+    layout = scan_jsonc_object(text)
+    indent = member_indent(text, layout)
+
+    def dumps(value: object) -> str:
+        return json.dumps(
+            value, indent=indent, ensure_ascii=False,
+        ).replace("\n", f"\n{indent}")
+
+    edits = []
+    missing = []
+    for key, value in settings.items():
+        span = layout.members.get(key)
+        if span is None:
+            missing.append(f"\n{indent}{json.dumps(key)}: {dumps(value)}")
+            continue
+        start, end = span
+        current = loads_jsonc(text[start:end])
+        if json.dumps(current, sort_keys=True) != json.dumps(value, sort_keys=True):
+            edits.append((start, end, dumps(value)))
+    if missing:
+        edits.extend(insert_members(text, layout, missing))
+    # Apply edits back to front, to keep positions of preceding edits valid;
+    # the sort is stable, so edits at the same position apply in order.
+    for start, end, replacement in sorted(
+            edits, key=lambda edit: edit[0], reverse=True):
+        text = text[:start] + replacement + text[end:]
+    return text
+
+
+def write_atomically(path: Path, text: str) -> None:
+    """Atomically replace the contents of `path` with `text`."""
+    temp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with temp_file.open("w") as sink:
+        sink.write(text)
+        sink.flush()
+        os.fsync(sink.fileno())
+    temp_file.replace(path)
 
 
 def update_config() -> None:
     """Update code configuration.
 
-    Read the vscode settings file, change specified settings and write it back again.
+    Patch specified settings into the vscode settings file, preserving comments
+    and formatting, and write it back again if anything changed.
     """
     config_file = Path.home() / ".config" / "Code - OSS" / "User" / "settings.json"
-    settings = {}
+    # Write through symlinks, instead of replacing them with a regular file
+    config_file = config_file.resolve()
+    original = "{}\n"
     if config_file.is_file():
-        with config_file.open() as source:
-            settings = json.load(source)
-    settings.update(SETTINGS)
+        original = config_file.read_text()
+    patched = patch_jsonc(original, SETTINGS)
+    if config_file.is_file() and patched == original:
+        return
     config_file.parent.mkdir(parents = True, exist_ok = True)
-    with config_file.open("w") as sink:
-        json.dump(settings, sink, indent=4)
+    write_atomically(config_file, patched)
 
 
 def main() -> None:
@@ -1,25 +1,40 @@
 # ruff: noqa: INP001, D100
+# The interactive hook deliberately imports lazily and uses os.path rather
+# than pathlib, to keep the time to the first prompt short.
+# ruff: noqa: PLC0415, PTH103, PTH105, PTH111, PTH118, PTH120, PTH123
 
 # Default imports for my interactive sessions
 import os
 import sys
-import contextlib
-from pathlib import Path
+import contextlib  # noqa: F401
+from pathlib import Path  # noqa: F401
 
 
-def _interactive_hook() -> None:
-    """My personal interactive hookself.
+def _make_interactive_hook():  # noqa: ANN202, C901
+    """Make my personal interactive hook.
 
-    Setup readline completion, and move python history to `$XDG_STATE_HOME`.
+    Keep all helpers in a closure, to keep them out of the interactive session.
     """
-    print("Hello :)") # noqa: T201
-    def _configure_readline() -> None:
+    # Avoid the expensive threading module; this one's builtin and thus cheap.
+    import _thread
+
+    def _report_startup_time(phase: str, start_ns: int) -> None:
+        """Report the time `phase` took since `start_ns`, if requested.
+
+        Run `python -X startuptime` to get a report of what startup costs, much like
+        `python -X importtime`.
+        """
+        if "startuptime" in sys._xoptions:  # noqa: SLF001
+            from time import perf_counter_ns
+            elapsed = (perf_counter_ns() - start_ns) // 1000
+            print(f"startup time: {elapsed:>9} | {phase}", file=sys.stderr)  # noqa: T201
+
+    def _configure_readline():  # noqa: ANN202
         """Configure readline.
 
-        Setup readline completion, and move readline history to `$XDG_STATE_HOME`.
+        Setup readline completion, and return the readline module.
         """
         import readline
-        import atexit
 
         # Reading the initialization (config) file may not be enough to set a
         # completion key, so we set one first and then read the file.
@@ -29,28 +44,197 @@ def _interactive_hook() -> None:
         else:
             readline.parse_and_bind("tab: complete")
 
-        with contextlib.suppress(OSError):
+        # Don't import contextlib just for suppress
+        try:  # noqa: SIM105
             readline.read_init_file()
+        except OSError:
+            pass
 
-        state_directory = Path(os.environ.get(
-            "XDG_STATE_HOME", Path.home() / ".local" / "state",
-        )) / "python"
-        state_directory.mkdir(parents=True, exist_ok=True)
+        return readline
 
-        histfile = state_directory / "python_history"
+    def _history_file() -> str:
+        """Get the path of the readline history file in `$XDG_STATE_HOME`."""
+        state_directory = os.path.join(os.environ.get(
+            "XDG_STATE_HOME", os.path.expanduser("~/.local/state"),
+        ), "python")
+        return os.path.join(state_directory, "python_history")
 
-        try:
-            readline.read_history_file(str(histfile))
-            readline.set_history_length(10000)
-        except FileNotFoundError:
-            pass
+    class _History:
+        """Incremental readline history in a file.
+
+        Append only the entries of this session to the history file, under a lock,
+        so that concurrent sessions don't overwrite each other's history.  Compact
+        the history file when it grows too large.
+
+        Readline isn't thread-safe, and releases the GIL while it waits for input,
+        so only the main thread may touch readline history.  Hence `load` only
+        reads the history file, and `insert` adds loaded entries to readline
+        history on the main thread.
+        """
+
+        # The number of entries to keep when compacting
+        length = 10000
+        # Compact once the history file has more entries than this
+        compact_threshold = 2 * length
+
+        def __init__(self: "_History", readline, histfile: str) -> None:  # noqa: ANN001
+            """Create a new history for `histfile`."""
+            self._readline = readline
+            self._histfile = histfile
+            # Entries loaded from the history file, until inserted into readline
+            self._loaded: list[str] | None = None
+            # The number of entries inserted into readline history
+            self._inserted_length = 0
+
+        def _lock(self: "_History") -> int:
+            """Lock the history file, and return the file descriptor of the lock.
+
+            Close the file descriptor to release the lock.
+            """
+            import fcntl
+            fd = os.open(f"{self._histfile}.lock", os.O_WRONLY | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return fd
+
+        def load(self: "_History") -> int:
+            """Load entries from the history file, for `insert`.
+
+            Do not touch readline, so this is safe to run in a thread.  Return the
+            number of loaded entries.
+            """
+            os.makedirs(os.path.dirname(self._histfile), exist_ok=True)
+            try:
+                with open(self._histfile, encoding="utf-8",
+                          errors="surrogateescape") as source:
+                    entries = [line.rstrip("\n") for line in source]
+            except FileNotFoundError:
+                entries = []
+            self._loaded = entries
+            return len(entries)
+
+        def insert(self: "_History") -> bool:
+            """Insert loaded entries into readline history, if loaded.
+
+            Put loaded entries before entries entered since the start of this
+            session.  Only call this on the main thread, and not while readline
+            reads a line.
+
+            Return whether we inserted loaded entries.
+            """
+            entries = self._loaded
+            if entries is None:
+                return False
+            self._loaded = None
+            readline = self._readline
+            session = [readline.get_history_item(i) for i in
+                       range(1, readline.get_current_history_length() + 1)]
+            readline.clear_history()
+            for entry in entries + session:
+                readline.add_history(entry)
+            self._inserted_length = len(entries)
+            return True
+
+        def compact(self: "_History") -> None:
+            """Compact the history file.
+
+            Remove duplicate entries, keeping the most recent one, and only keep
+            the most recent `length` entries.
+            """
+            lock = self._lock()
+            try:
+                with open(self._histfile, encoding="utf-8",
+                          errors="surrogateescape") as source:
+                    entries = source.readlines()
+                if len(entries) <= self.compact_threshold:
+                    # Another session compacted already
+                    return
+                seen = set()
+                compacted = []
+                for entry in reversed(entries):
+                    if entry not in seen:
+                        seen.add(entry)
+                        compacted.append(entry)
+                    if self.length <= len(compacted):
+                        break
+                compacted.reverse()
+                temp_file = f"{self._histfile}.{os.getpid()}.tmp"
+                with open(temp_file, "w", encoding="utf-8",
+                          errors="surrogateescape") as sink:
+                    sink.writelines(compacted)
+                os.replace(temp_file, self._histfile)
+            finally:
+                os.close(lock)
+
+        def append(self: "_History") -> None:
+            """Append all entries of this session to the history file."""
+            new_entries = (self._readline.get_current_history_length()
+                           - self._inserted_length)
+            if new_entries <= 0:
+                return
+            lock = self._lock()
+            try:
+                # append_history_file doesn't create the history file
+                os.close(os.open(self._histfile, os.O_WRONLY | os.O_CREAT, 0o600))
+                self._readline.append_history_file(new_entries, self._histfile)
+            finally:
+                os.close(lock)
+
+    class _HistoryPrompt:
+        """A primary prompt which inserts loaded history into readline.
+
+        Readline loses history entries modified while it reads a line, even from
+        its own startup hooks.  Python renders the prompt on the main thread right
+        before it calls readline, so insert loaded history there instead.
+        """
+
+        def __init__(self: "_HistoryPrompt", history: _History, prompt: str) -> None:
+            """Create a new `prompt` which inserts `history`."""
+            self._history = history
+            self._prompt = prompt
+
+        def __str__(self: "_HistoryPrompt") -> str:
+            """Insert history if loaded, and return the prompt."""
+            if self._history.insert():
+                sys.ps1 = self._prompt
+            return self._prompt
+
+    def _deferred_startup(history: _History) -> None:
+        """Run all startup work not needed for the first prompt."""
+        from time import perf_counter_ns
+        start = perf_counter_ns()
+        loaded = history.load()
+        _report_startup_time("history (deferred)", start)
+        if history.compact_threshold < loaded:
+            start = perf_counter_ns()
+            history.compact()
+            _report_startup_time("history compaction (deferred)", start)
+
+    def _interactive_hook() -> None:
+        """My personal interactive hookself.
+
+        Setup readline completion, and move python history to `$XDG_STATE_HOME`.
+
+        Only do what the first prompt needs right away, and load history in a
+        background thread, to insert into readline at the next prompt.
+        """
+        import atexit
+        from time import perf_counter_ns
+
+        start = perf_counter_ns()
+        print("Hello :)") # noqa: T201
+        readline = _configure_readline()
+        _report_startup_time("readline", start)
 
-        atexit.register(readline.write_history_file, histfile)
+        history = _History(readline, _history_file())
+        sys.ps1 = _HistoryPrompt(history, str(getattr(sys, "ps1", ">>> ")))
+        _thread.start_new_thread(_deferred_startup, (history,))
+        atexit.register(history.append)
+        _report_startup_time("interactive hook", start)
 
-    _configure_readline()
+    return _interactive_hook
 
 
 # __interactivehook__ only exists in interactive sessions, and thus has no type
 # stubs, so silence the type checker here.
-sys.__interactivehook__ = _interactive_hook  # type: ignore[reportGeneralTypeIssues]
-del _interactive_hook
+sys.__interactivehook__ = _make_interactive_hook()  # type: ignore[reportGeneralTypeIssues]
+del _make_interactive_hook
@@ -0,0 +1,269 @@
+# Copyright Sebastian Wiesner <sebastian@swsnr.de>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Tests for reading PDF creation dates in bin/paperwork-tool."""
+
+from datetime import date
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+from pathlib import Path
+from subprocess import CompletedProcess
+
+import pytest
+
+
+def _load_paperwork_tool():  # noqa: ANN202
+    """Load bin/paperwork-tool as a module."""
+    path = Path(__file__).parent.parent / "bin" / "paperwork-tool"
+    loader = SourceFileLoader("paperwork_tool", str(path))
+    spec = spec_from_loader("paperwork_tool", loader)
+    assert spec is not None
+    module = module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+paperwork_tool = _load_paperwork_tool()
+
+
+def info_object(creation_date: bytes) -> bytes:
+    """Make an Info dictionary with the given `creation_date` string."""
+    return b"<< /Producer (test) /CreationDate " + creation_date + b" >>"
+
+
+def xref_table(offsets: dict[int, int], eol: bytes = b" \n") -> bytes:
+    """Make a cross-reference table for the objects at `offsets`.
+
+    Make one subsection per object, and end every entry with `eol`, which must
+    have two bytes.
+    """
+    table = b"xref\n"
+    if 0 not in offsets:
+        table += b"0 1\n" + b"0000000000 65535 f" + eol
+    for number, offset in sorted(offsets.items()):
+        table += b"%d 1\n" % number + b"%010d 00000 n" % offset + eol
+    return table
+
+
+def build_pdf(objects: dict[int, bytes], trailer: bytes,
+              eol: bytes = b" \n") -> bytes:
+    """Build a PDF with a classic cross-reference table.
+
+    `objects` maps object numbers to object bodies, and `trailer` has the
+    contents of the trailer dictionary.
+    """
+    pdf = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    offsets = {}
+    for number, body in objects.items():
+        offsets[number] = len(pdf)
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    startxref = len(pdf)
+    pdf += xref_table(offsets, eol)
+    pdf += b"trailer\n<< " + trailer + b" >>\nstartxref\n%d\n%%%%EOF\n" % startxref
+    return pdf
+
+
+def update_pdf(pdf: bytes, objects: dict[int, bytes], trailer: bytes) -> bytes:
+    """Append an incremental update with `objects` to `pdf`."""
+    previous = int(pdf.rsplit(b"startxref", 1)[1].split()[0])
+    offsets = {}
+    for number, body in objects.items():
+        offsets[number] = len(pdf)
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    startxref = len(pdf)
+    pdf += xref_table(offsets)
+    pdf += b"trailer\n<< " + trailer + b" /Prev %d >>\n" % previous
+    pdf += b"startxref\n%d\n%%%%EOF\n" % startxref
+    return pdf
+
+
+def xmp_packet(create_date: str) -> bytes:
+    """Make an XMP metadata stream object with the given `create_date`."""
+    packet = (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF>'
+        '<rdf:Description xmlns:xmp="http://ns.adobe.com/xap/1.0/">'
+        f"<xmp:CreateDate>{create_date}</xmp:CreateDate>"
+        "</rdf:Description></rdf:RDF></x:xmpmeta>"
+    ).encode()
+    return (b"<< /Type /Metadata /Subtype /XML /Length %d >>\nstream\n"
+            % len(packet)) + packet + b"\nendstream"
+
+
+CATALOG = b"<< /Type /Catalog /Pages 2 0 R >>"
+PAGES = b"<< /Type /Pages /Kids [] /Count 0 >>"
+
+
+@pytest.fixture
+def write_pdf(tmp_path: Path):  # noqa: ANN201
+    """Write PDF contents to a temporary file and return its path."""
+    def write(contents: bytes) -> Path:
+        path = tmp_path / "test.pdf"
+        path.write_bytes(contents)
+        return path
+    return write
+
+
+@pytest.mark.parametrize(("value", "expected"), [
+    ("D:20230105120000+01'00'", date(2023, 1, 5)),
+    ("D:20230105120000Z", date(2023, 1, 5)),
+    ("D:20230105120000-08'00", date(2023, 1, 5)),
+    ("D:20230105120000Z00'00'", date(2023, 1, 5)),
+    ("D:20230105", date(2023, 1, 5)),
+    ("D:202301", date(2023, 1, 1)),
+    ("D:2023", date(2023, 1, 1)),
+    ("20230105120000", date(2023, 1, 5)),
+    ("  D:20230105120000  ", date(2023, 1, 5)),
+    ("2023-01-05T12:00:00+01:00", date(2023, 1, 5)),
+    ("2023-01-05", date(2023, 1, 5)),
+])
+def test_parse_pdf_date(value: str, expected: date) -> None:
+    assert paperwork_tool.parse_pdf_date(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "D:", "D:23", "yesterday", "D:2023x"])
+def test_parse_pdf_date_invalid(value: str) -> None:
+    with pytest.raises(ValueError, match="date"):
+        paperwork_tool.parse_pdf_date(value)
+
+
+@pytest.mark.parametrize(("value", "expected"), [
+    (b"(D:20230105)", "D:20230105"),
+    (b"(D:2023\\(01\\))", "D:2023(01)"),
+    (b"<443A3230323330313035>", "D:20230105"),
+    (b"<443a 3230 3233 3031 3035>", "D:20230105"),
+    (b"<FEFF0044003A00320030003200330030003100300035>", "D:20230105"),
+    (b"(\xfe\xff\x00D\x00:\x002\x000\x002\x003)", "D:2023"),
+])
+def test_decode_pdf_string(value: bytes, expected: str) -> None:
+    assert paperwork_tool.decode_pdf_string(value) == expected
+
+
+@pytest.mark.parametrize("eol", [b" \n", b"\r\n", b" \r"])
+def test_info_dictionary(write_pdf, eol: bytes) -> None:  # noqa: ANN001
+    pdf = build_pdf({
+        1: CATALOG,
+        2: PAGES,
+        3: info_object(b"(D:20230105120000+01'00')"),
+    }, b"/Size 4 /Root 1 0 R /Info 3 0 R", eol=eol)
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) == \
+        date(2023, 1, 5)
+
+
+@pytest.mark.parametrize("creation_date", [
+    b"<443A32303231303631353130333030305A>",
+    b"<FEFF0044003A00320030003200310030003600310035>",
+    b"(\xfe\xff\x00D\x00:\x002\x000\x002\x001\x000\x006\x001\x005)",
+])
+def test_info_dictionary_encoded_strings(write_pdf,  # noqa: ANN001
+                                         creation_date: bytes) -> None:
+    pdf = build_pdf({1: CATALOG, 2: PAGES, 3: info_object(creation_date)},
+                    b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) == \
+        date(2021, 6, 15)
+
+
+def test_incremental_update_with_prev(write_pdf) -> None:  # noqa: ANN001
+    original = build_pdf({
+        1: CATALOG,
+        2: PAGES,
+        3: info_object(b"(D:20200101)"),
+    }, b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    # The update redefines the Info dictionary, and the trailer of the update
+    # only has the new object, so we must follow /Prev for everything else.
+    updated = update_pdf(original, {3: info_object(b"(D:20220202)")},
+                         b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(updated)) == \
+        date(2022, 2, 2)
+
+
+def test_incremental_update_info_in_previous_section(write_pdf) -> None:  # noqa: ANN001
+    original = build_pdf({
+        1: CATALOG,
+        2: PAGES,
+        3: info_object(b"(D:20200101)"),
+    }, b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    updated = update_pdf(original, {2: PAGES},
+                         b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(updated)) == \
+        date(2020, 1, 1)
+
+
+def test_xref_stream(write_pdf) -> None:  # noqa: ANN001
+    pdf = b"%PDF-1.5\n"
+    for number, body in [(1, CATALOG), (2, PAGES),
+                         (3, info_object(b"(D:20190707)"))]:
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    startxref = len(pdf)
+    # We don't decode cross-reference streams, so the stream data does not
+    # matter here.
+    pdf += (b"4 0 obj\n<< /Type /XRef /Size 5 /W [1 2 1] /Root 1 0 R "
+            b"/Info 3 0 R /Length 4 >>\nstream\n\x00\x00\x00\x00\nendstream\n"
+            b"endobj\n")
+    pdf += b"startxref\n%d\n%%%%EOF\n" % startxref
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) == \
+        date(2019, 7, 7)
+
+
+def test_xmp_only(write_pdf) -> None:  # noqa: ANN001
+    pdf = build_pdf({
+        1: b"<< /Type /Catalog /Pages 2 0 R /Metadata 3 0 R >>",
+        2: PAGES,
+        3: xmp_packet("2018-08-08T10:00:00+02:00"),
+    }, b"/Size 4 /Root 1 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) == \
+        date(2018, 8, 8)
+
+
+def test_xmp_attribute(write_pdf) -> None:  # noqa: ANN001
+    packet = (b'<rdf:Description xmp:CreateDate="2017-07-17T00:00:00Z"/>')
+    pdf = build_pdf({1: CATALOG, 2: PAGES, 3: b"<< >>\nstream\n" + packet
+                     + b"\nendstream"}, b"/Size 4 /Root 1 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) == \
+        date(2017, 7, 17)
+
+
+def test_no_creation_date(write_pdf) -> None:  # noqa: ANN001
+    pdf = build_pdf({1: CATALOG, 2: PAGES, 3: b"<< /Producer (test) >>"},
+                    b"/Size 4 /Root 1 0 R /Info 3 0 R")
+    assert paperwork_tool.read_pdf_creation_date(write_pdf(pdf)) is None
+
+
+def test_not_a_pdf(write_pdf) -> None:  # noqa: ANN001
+    path = write_pdf(b"Definitely not a PDF")
+    assert paperwork_tool.read_pdf_creation_date(path) is None
+
+
+def test_encrypted_falls_back_to_pdfinfo(
+        write_pdf, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: ANN001
+    pdf = build_pdf({
+        1: CATALOG,
+        2: PAGES,
+        # Encrypted strings are garbage without decryption
+        3: info_object(b"<9F3A11C0D2>"),
+        4: b"<< /Filter /Standard /V 2 /R 3 /Length 128 /P -4 >>",
+    }, b"/Size 5 /Root 1 0 R /Info 3 0 R /Encrypt 4 0 R")
+    path = write_pdf(pdf)
+    assert paperwork_tool.read_pdf_creation_date(path) is None
+
+    commands = []
+
+    def fake_run(command: list[str], **_kwargs) -> CompletedProcess:  # noqa: ANN003
+        commands.append(command)
+        return CompletedProcess(
+            command, 0, stdout="Title: x\nCreationDate:    2016-06-16T12:00:00+02\n",
+            stderr="")
+
+    monkeypatch.setattr(paperwork_tool, "run", fake_run)
+    assert paperwork_tool.get_pdf_creation_date(path) == date(2016, 6, 16)
+    assert commands == [["pdfinfo", "-isodates", str(path)]]